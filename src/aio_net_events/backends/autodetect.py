@@ -1,9 +1,14 @@
 import platform
 
+from functools import lru_cache
 from pathlib import Path
+from typing import Type
 
 from .base import NetworkEventDetectorBackend
 
+_SYSTEM = platform.system()
+_HAS_NETLINK = _SYSTEM == "Linux" and Path("/proc/net/netlink").exists()
+
 
 def choose_backend() -> NetworkEventDetectorBackend:
     """Chooses an appropriate network event detector backend for the current
@@ -12,15 +17,25 @@ def choose_backend() -> NetworkEventDetectorBackend:
     Returns:
         a newly constructed network event detector backend instance
     """
-    if platform.system() == "Linux" and Path("/proc/net/netlink").exists():
+    return _resolve_backend_class()()
+
+
+@lru_cache(maxsize=None)
+def _resolve_backend_class() -> Type[NetworkEventDetectorBackend]:
+    """Returns the class of the network event detector backend that is the most
+    appropriate for the current platform.
+
+    The result is cached so the backend module is imported only once.
+    """
+    if _HAS_NETLINK:
         from .netlink import NetlinkBasedNetworkEventDetectorBackend
 
-        return NetlinkBasedNetworkEventDetectorBackend()
-    elif platform.system() == "Darwin":
+        return NetlinkBasedNetworkEventDetectorBackend
+    elif _SYSTEM == "Darwin":
         from .macos import SystemConfigurationBasedNetworkEventDetectorBackend
 
-        return SystemConfigurationBasedNetworkEventDetectorBackend()
+        return SystemConfigurationBasedNetworkEventDetectorBackend
     else:
         from .portable import PortableNetworkEventDetectorBackend
 
-        return PortableNetworkEventDetectorBackend()
+        return PortableNetworkEventDetectorBackend
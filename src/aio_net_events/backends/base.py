@@ -2,16 +2,52 @@
 
 from abc import abstractmethod, ABCMeta
 from contextlib import asynccontextmanager
-from typing import AsyncIterator, Any, Dict, List
-
-__all__ = ("NetworkEventDetectorBackend",)
+from enum import Enum
+from typing import (
+    AsyncIterator,
+    Any,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+__all__ = ("NetworkEvent", "NetworkEventDetectorBackend", "NetworkEventType")
 
 NetworkInterface = Any
 
 
+class NetworkEventType(Enum):
+    """Enum representing the possible network event types."""
+
+    INTERFACE_ADDED = "interface_added"
+    INTERFACE_REMOVED = "interface_removed"
+    ADDRESS_ADDED = "address_added"
+    ADDRESS_REMOVED = "address_removed"
+
+
+NetworkEvent = NamedTuple(
+    "NetworkEvent",
+    [
+        ("type", NetworkEventType),
+        ("interface", NetworkInterface),
+        ("address_family", Optional[int]),
+        ("address", Any),
+        ("key", str),
+    ],
+)
+
+
 class NetworkEventDetectorBackend(metaclass=ABCMeta):
     """Interface specification for network event detector backends."""
 
+    supports_incremental: bool = False
+    """Whether the backend is able to report changes incrementally with its
+    `events()` method instead of having to be scanned repeatedly.
+    """
+
     def configure(self, configuration: Dict[str, Any]) -> None:  # noqa: B027
         """Configures the detector backend and specifies what the backend should
         report.
@@ -25,14 +61,37 @@ class NetworkEventDetectorBackend(metaclass=ABCMeta):
         """
         pass  # pragma: no cover
 
+    async def events(self) -> AsyncIterator[NetworkEvent]:
+        """Async generator that yields events describing the changes of the
+        network configuration as they happen.
+
+        This method is used only if `supports_incremental` is `True`. The
+        detector always calls `scan()` and `get_addresses()` first to obtain
+        the initial state, and then it consumes this generator until it is
+        suspended. The generator should report changes that happened after the
+        most recent call to `scan()`; the detector ignores events that are
+        redundant with respect to its current state, so there is no need to
+        filter them in the backend.
+
+        The default implementation raises `NotImplementedError`.
+        """
+        raise NotImplementedError  # pragma: no cover
+        yield  # pragma: no cover
+
     @abstractmethod
-    async def get_addresses(self, interface: NetworkInterface) -> Dict[int, List[Any]]:
+    async def get_addresses(
+        self, interface: NetworkInterface
+    ) -> Optional[Dict[int, Sequence[Any]]]:
         """Returns all known addresses for a given network interface.
 
         Returns:
             a dictionary mapping address family identifiers (typically numbers)
-            to lists of corresponding network addresses. It is guaranteed to be
-            an instance that the caller can freely modify.
+            to sequences of corresponding network addresses. It is guaranteed
+            to be an instance that the caller can freely modify. Backends
+            should return the addresses of each family in a consistent order
+            (e.g., as sorted tuples) so the detector can detect unchanged
+            interfaces with a simple equality check. `None` means that the
+            interface does not exist any more.
         """
         raise NotImplementedError  # pragma: no cover
 
@@ -53,6 +112,21 @@ class NetworkEventDetectorBackend(metaclass=ABCMeta):
         """
         raise NotImplementedError  # pragma: no cover
 
+    async def scan_keyed(self) -> List[Tuple[str, NetworkInterface]]:
+        """Scans the system for network interfaces and returns the list of
+        interfaces found, along with their keys.
+
+        The default implementation calls `scan()` and `key_of()`. Backends that
+        already know the keys of the interfaces while scanning may override
+        this method to avoid calling `key_of()` for each interface.
+
+        Returns:
+            a list of pairs, each consisting of the key of an interface and the
+            interface itself
+        """
+        key_of = self.key_of
+        return [(key_of(interface), interface) for interface in await self.scan()]
+
     @asynccontextmanager
     async def use(self) -> AsyncIterator[None]:
         """Async context manager that is entered when the backend starts up and
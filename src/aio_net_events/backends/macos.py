@@ -1,10 +1,37 @@
-from anyio import Condition, create_task_group, from_thread, to_thread
+from anyio import (
+    WouldBlock,
+    create_memory_object_stream,
+    create_task_group,
+    from_thread,
+    to_thread,
+)
+from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
 from contextlib import asynccontextmanager
 from functools import partial
-from typing import AsyncIterator, Optional
+from threading import Event
+from typing import Any, AsyncIterator, Optional
 
 from .portable import PortableNetworkEventDetectorBackend
 
+try:
+    from Foundation import (
+        CFRunLoopAddSource,
+        CFRunLoopGetCurrent,
+        CFRunLoopRunInMode,
+        CFRunLoopStop,
+        kCFRunLoopCommonModes,
+        kCFRunLoopDefaultMode,
+    )
+    from SystemConfiguration import (
+        SCDynamicStoreCreate,
+        SCDynamicStoreSetNotificationKeys,
+        SCDynamicStoreCreateRunLoopSource,
+    )
+except ImportError:  # pragma: no cover
+    _HAS_PYOBJC = False
+else:
+    _HAS_PYOBJC = True
+
 __all__ = ("SystemConfigurationBasedNetworkEventDetectorBackend",)
 
 
@@ -22,31 +49,54 @@ class SystemConfigurationBasedNetworkEventDetectorBackend(
     default portable backend.
     """
 
-    _condition: Optional[Condition]
+    _receive_stream: MemoryObjectReceiveStream[None]
+    """Stream that the backend reads when it waits for the next network
+    change event.
+    """
+
+    _send_stream: MemoryObjectSendStream[None]
+    """Stream that the backend writes when the network configuration has
+    changed. It can hold at most one item so bursts of notifications are
+    coalesced into a single scan.
+    """
+
+    _runloop: Optional[Any]
+    """The CFRunLoop of the worker thread while the worker thread is running."""
 
     def __init__(self) -> None:
         super().__init__()
-        self._condition = None
+        self._runloop = None
+        self._send_stream, self._receive_stream = create_memory_object_stream(1)
 
     @asynccontextmanager
     async def use(self) -> AsyncIterator[None]:
-        self._ensure_condition_exists()
+        stop_requested = Event()
         async with create_task_group() as tg:
             tg.start_soon(
-                partial(to_thread.run_sync, self._run_worker_thread, cancellable=True)
+                partial(
+                    to_thread.run_sync,
+                    self._run_worker_thread,
+                    stop_requested,
+                    cancellable=True,
+                )
             )
-            yield
+            try:
+                yield
+            finally:
+                self._stop_worker_thread(stop_requested)
+                tg.cancel_scope.cancel()
 
-    def _ensure_condition_exists(self) -> None:
-        """Creates the condition object that the backend will use to notify
-        listeners about network change events.
+    def _notify(self) -> None:
+        """Notifies the waiting tasks that the network configuration has
+        changed.
 
-        This function is used to avoid having to create a condition object
-        in the constructor, which may be executed outside the context of an
-        event loop.
+        This function runs in the context of the main event loop.
         """
-        if self._condition is None:
-            self._condition = Condition()
+        try:
+            self._send_stream.send_nowait(None)
+        except WouldBlock:
+            # A notification is already pending
+            pass
 
     def _on_network_changed(self, *args, **kwds):
         """Callback that is called by the SystemConfiguration framework when
@@ -54,31 +104,20 @@ class SystemConfigurationBasedNetworkEventDetectorBackend(
 
         This function runs in the context of the worker thread.
         """
-        from_thread.run(self._on_network_changed_main)
+        from_thread.run_sync(self._notify)
 
-    async def _on_network_changed_main(self):
-        """Task that is scheduled on the main event loop when the network
-        configuration has changed.
+    def _run_worker_thread(self, stop_requested: Event) -> None:
+        """Runs the worker thread that waits for network events.
 
-        This function runs in the context of the main event loop.
+        Parameters:
+            stop_requested: event that is set by the main thread when the
+                worker thread should terminate
         """
-        assert self._condition is not None
-        async with self._condition:
-            self._condition.notify_all()
-
-    def _run_worker_thread(self):
-        """Runs the worker thread that waits for network events."""
-        from Foundation import (
-            CFRunLoopAddSource,
-            CFRunLoopGetCurrent,
-            kCFRunLoopCommonModes,
-            CFRunLoopRun,
-        )
-        from SystemConfiguration import (
-            SCDynamicStoreCreate,
-            SCDynamicStoreSetNotificationKeys,
-            SCDynamicStoreCreateRunLoopSource,
-        )
+        if not _HAS_PYOBJC:
+            raise RuntimeError(
+                "PyObjC and its SystemConfiguration bindings are required "
+                "for this backend"
+            )
 
         store = SCDynamicStoreCreate(
             None, "global-network-watcher", self._on_network_changed, None
@@ -87,17 +126,36 @@ class SystemConfigurationBasedNetworkEventDetectorBackend(
             store, None, ["State:/Network/Global/IPv4", "State:/Network/Global/IPv6"]
         )
 
+        runloop = CFRunLoopGetCurrent()
         CFRunLoopAddSource(
-            CFRunLoopGetCurrent(),
+            runloop,
             SCDynamicStoreCreateRunLoopSource(None, store, 0),
             kCFRunLoopCommonModes,
         )
 
-        CFRunLoopRun()
+        self._runloop = runloop
+        try:
+            # The main thread stops the run loop when it sets the event. The
+            # timeout takes care of the case when the stop request arrives
+            # before the run loop has started.
+            while not stop_requested.is_set():
+                CFRunLoopRunInMode(kCFRunLoopDefaultMode, 1.0, False)
+        finally:
+            self._runloop = None
 
-    async def wait_until_next_scan(self) -> None:
-        assert self._condition is not None
+    def _stop_worker_thread(self, stop_requested: Event) -> None:
+        """Asks the worker thread to terminate.
+
+        This function runs in the context of the main event loop.
 
-        self._ensure_condition_exists()
-        async with self._condition:
-            await self._condition.wait()
+        Parameters:
+            stop_requested: the event that the worker thread is watching
+        """
+        stop_requested.set()
+
+        runloop = self._runloop
+        if runloop is not None:
+            CFRunLoopStop(runloop)
+
+    async def wait_until_next_scan(self) -> None:
+        await self._receive_stream.receive()
@@ -1,13 +1,109 @@
-from anyio import sleep, wait_socket_readable
-from os import getpid
+from anyio import wait_socket_readable
+from anyio.lowlevel import checkpoint
+from errno import ENOBUFS
+from os import fsdecode
+from socket import (
+    AF_INET,
+    AF_INET6,
+    AF_PACKET,
+    MSG_DONTWAIT,
+    if_indextoname,
+    if_nameindex,
+    inet_ntop,
+)
+from struct import Struct
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
 
+from .base import NetworkEvent, NetworkEventType, NetworkInterface
 from .portable import PortableNetworkEventDetectorBackend
 
+__all__ = ("NetlinkBasedNetworkEventDetectorBackend",)
 
-RTMGRP_LINK = 1
-RTMGRP_IPV4_IFADDR = 0x10
-RTMGRP_IPV6_IFADDR = 0x100
-RTMGRP_DECnet_IFADDR = 0x1000
+
+SOL_NETLINK = 270
+NETLINK_ADD_MEMBERSHIP = 1
+
+RTNLGRP_LINK = 1
+RTNLGRP_IPV4_IFADDR = 5
+RTNLGRP_IPV6_IFADDR = 9
+RTNLGRP_DECnet_IFADDR = 13
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+
+LINK_LAYER_FAMILY = int(AF_PACKET)
+"""Address family of link-layer addresses. It is a plain integer, not an
+`AddressFamily` member, to match the address families reported by
+`netifaces` during a scan.
+"""
+
+NLMSGHDR = Struct("=IHHII")
+"""Header of a netlink message: length, type, flags, sequence number and
+port ID.
+"""
+
+IFINFOMSG = Struct("=BxHiII")
+"""Body of an RTM_NEWLINK or RTM_DELLINK message: family, device type,
+interface index, flags and change mask.
+"""
+
+IFADDRMSG = Struct("=BBBBI")
+"""Body of an RTM_NEWADDR or RTM_DELADDR message: family, prefix length,
+flags, scope and interface index.
+"""
+
+RTATTR = Struct("=HH")
+"""Header of a routing attribute: length and type."""
+
+MAX_DATAGRAMS_PER_CHECKPOINT = 64
+"""Maximum number of datagrams that the backend processes from the netlink
+socket without yielding control to other tasks.
+"""
+
+RECV_BUFFER_SIZE = 65536
+"""Size of the buffer that we use to read messages from the netlink socket.
+Must be large enough to hold the largest datagram that the kernel may send.
+"""
+
+
+class _RescanRequired(Exception):
+    """Raised while processing netlink messages when the change that they
+    describe cannot be expressed as a sequence of events and the backend
+    needs a full scan instead.
+    """
+
+
+def _align(length: int) -> int:
+    """Rounds up a length to the nearest multiple of four, as required by
+    the alignment rules of netlink messages and routing attributes.
+    """
+    return (length + 3) & ~3
+
+
+def _parse_attributes(data: memoryview, offset: int, end: int) -> Dict[int, memoryview]:
+    """Parses the routing attributes found in the given slice of a netlink
+    message.
+
+    Returns:
+        a dictionary mapping attribute types to their raw payloads
+    """
+    result = {}
+    while offset + RTATTR.size <= end:
+        length, attr_type = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size or offset + length > end:
+            # Malformed or truncated attribute
+            break
+        result[attr_type] = data[offset + RTATTR.size : offset + length]
+        offset += _align(length)
+    return result
 
 
 class NetlinkBasedNetworkEventDetectorBackend(PortableNetworkEventDetectorBackend):
@@ -15,41 +111,294 @@ class NetlinkBasedNetworkEventDetectorBackend(PortableNetworkEventDetectorBacken
 
     This backend works similarly to the PortableNetworkEventDetectorBackend_,
     but it uses a netlink socket to detect changes to network interfaces and
-    addresses instead of polling the network configuration.
+    addresses instead of polling the network configuration. The initial state
+    is retrieved with `netifaces`; subsequent changes are decoded directly
+    from the netlink messages sent by the kernel, without re-scanning the
+    interfaces.
 
     This backend is preferred by the autodetection mechanism on Linux over the
     default portable backend if it detects that netlink support is enabled in
     the kernel.
     """
 
+    supports_incremental = True
+
+    _buffer: bytearray
+    """Preallocated buffer that the messages from the netlink socket are read
+    into.
+    """
+
+    _indices: Dict[str, int]
+    """Dictionary mapping interface names to interface indices, as seen at the
+    last scan.
+    """
+
+    _link_addresses: Dict[int, str]
+    """Dictionary mapping interface indices to the most recently seen
+    link-layer address of the interface.
+    """
+
+    _names: Dict[int, str]
+    """Dictionary mapping interface indices to interface names."""
+
     def __init__(self):
         """Constructor."""
         super().__init__()
 
-        from socket import socket, AF_NETLINK, SOCK_RAW, NETLINK_ROUTE
+        from socket import (
+            socket,
+            AF_NETLINK,
+            NETLINK_ROUTE,
+            SOCK_CLOEXEC,
+            SOCK_NONBLOCK,
+            SOCK_RAW,
+        )
 
-        self._socket = socket(AF_NETLINK, SOCK_RAW, NETLINK_ROUTE)
-        self._socket.bind(
-            (
-                getpid(),
-                RTMGRP_LINK
-                | RTMGRP_IPV4_IFADDR
-                | RTMGRP_IPV6_IFADDR
-                | RTMGRP_DECnet_IFADDR,
-            )
+        self._buffer = bytearray(RECV_BUFFER_SIZE)
+        self._indices = {}
+        self._link_addresses = {}
+        self._names = {}
+
+        self._socket = socket(
+            AF_NETLINK, SOCK_RAW | SOCK_NONBLOCK | SOCK_CLOEXEC, NETLINK_ROUTE
         )
-        self._socket.setblocking(False)
+        self._socket.bind((0, 0))
+        for group in (
+            RTNLGRP_LINK,
+            RTNLGRP_IPV4_IFADDR,
+            RTNLGRP_IPV6_IFADDR,
+            RTNLGRP_DECnet_IFADDR,
+        ):
+            self._socket.setsockopt(SOL_NETLINK, NETLINK_ADD_MEMBERSHIP, group)
 
     def __del__(self):
         self._socket.close()
 
+    async def events(self) -> AsyncIterator[NetworkEvent]:
+        buffer = memoryview(self._buffer)
+        recv_into = self._socket.recv_into
+
+        while True:
+            await wait_socket_readable(self._socket)
+            try:
+                count = 0
+                while True:
+                    size = recv_into(buffer, RECV_BUFFER_SIZE, MSG_DONTWAIT)
+                    if size <= 0:
+                        break
+
+                    # Events hold no references to the buffer so it is safe
+                    # to reuse it once all the messages have been processed
+                    for event in self._process_messages(buffer[:size]):
+                        yield event
+
+                    count += 1
+                    if count == MAX_DATAGRAMS_PER_CHECKPOINT:
+                        # Let other tasks run during long bursts
+                        count = 0
+                        await checkpoint()
+            except BlockingIOError:
+                pass
+            except _RescanRequired:
+                return
+            except OSError as ex:
+                if ex.errno == ENOBUFS:
+                    # The kernel dropped some messages so we cannot trust our
+                    # incremental view any more; returning makes the detector
+                    # fall back to a full scan
+                    return
+                raise
+
+    async def get_addresses(
+        self, interface: NetworkInterface
+    ) -> Optional[Dict[int, Sequence[Any]]]:
+        addresses = await super().get_addresses(interface)
+
+        # Remember the link-layer address found by the scan so we can report
+        # its removal when the kernel tells us that it has changed
+        index = self._indices.get(interface)
+        if index is not None:
+            link_addresses = addresses.get(LINK_LAYER_FAMILY) if addresses else None
+            if link_addresses:
+                self._link_addresses[index] = link_addresses[0]
+            else:
+                self._link_addresses.pop(index, None)
+
+        return addresses
+
+    async def scan(self) -> List[NetworkInterface]:
+        # Messages received so far are superseded by the result of the scan
+        self._discard_pending_messages()
+        self._names = dict(if_nameindex())
+        self._indices = {name: index for index, name in self._names.items()}
+        self._link_addresses.clear()
+        return await super().scan()
+
     async def wait_until_next_scan(self) -> None:
         await wait_socket_readable(self._socket)
+        self._discard_pending_messages()
+        await checkpoint()
+
+    def _discard_pending_messages(self) -> None:
+        """Reads and discards all the messages that are waiting in the receive
+        buffer of the netlink socket.
+        """
+        recv_into = self._socket.recv_into
         while True:
             try:
-                data = self._socket.recv(4096)
-                if not data:
+                if recv_into(self._buffer, RECV_BUFFER_SIZE, MSG_DONTWAIT) <= 0:
                     break
-            except BlockingIOError:
+            except (BlockingIOError, InterruptedError):
                 break
-            await sleep(0)
+            except OSError as ex:
+                if ex.errno != ENOBUFS:
+                    raise
+
+    def _event(
+        self,
+        event_type: NetworkEventType,
+        name: str,
+        family: Optional[int] = None,
+        address: Optional[str] = None,
+    ) -> NetworkEvent:
+        """Creates a network event for the network interface with the given
+        name.
+        """
+        return NetworkEvent(event_type, name, family, address, self.key_of(name))
+
+    def _process_address_message(
+        self, msg_type: int, data: memoryview, offset: int, end: int
+    ) -> Iterator[NetworkEvent]:
+        """Processes an RTM_NEWADDR or RTM_DELADDR message.
+
+        Parameters:
+            msg_type: the type of the message
+            data: the buffer containing the message
+            offset: offset of the body of the message in the buffer
+            end: offset of the end of the message in the buffer
+        """
+        if offset + IFADDRMSG.size > end:
+            return
+
+        family, _prefix_length, _flags, _scope, index = IFADDRMSG.unpack_from(
+            data, offset
+        )
+        if family != AF_INET and family != AF_INET6:
+            return
+
+        attrs = _parse_attributes(data, offset + IFADDRMSG.size, end)
+
+        # IFA_ADDRESS is the peer address on point-to-point links so we prefer
+        # IFA_LOCAL if it is present, just like getifaddrs() does
+        raw_address = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+        if raw_address is None:
+            return
+
+        name = self._names.get(index)
+        if name is None:
+            try:
+                name = self._names[index] = if_indextoname(index)
+            except OSError:
+                # Interface is already gone
+                return
+
+        address = inet_ntop(family, raw_address)
+        if (
+            family == AF_INET6
+            and raw_address[0] == 0xFE
+            and raw_address[1] & 0xC0 == 0x80
+        ):
+            # netifaces appends the scope to link-local IPv6 addresses
+            address = f"{address}%{name}"
+
+        yield self._event(
+            NetworkEventType.ADDRESS_ADDED
+            if msg_type == RTM_NEWADDR
+            else NetworkEventType.ADDRESS_REMOVED,
+            name,
+            family,
+            address,
+        )
+
+    def _process_link_message(
+        self, msg_type: int, data: memoryview, offset: int, end: int
+    ) -> Iterator[NetworkEvent]:
+        """Processes an RTM_NEWLINK or RTM_DELLINK message.
+
+        Parameters:
+            msg_type: the type of the message
+            data: the buffer containing the message
+            offset: offset of the body of the message in the buffer
+            end: offset of the end of the message in the buffer
+        """
+        if offset + IFINFOMSG.size > end:
+            return
+
+        _family, _device_type, index, _flags, _change = IFINFOMSG.unpack_from(
+            data, offset
+        )
+        attrs = _parse_attributes(data, offset + IFINFOMSG.size, end)
+
+        raw_name = attrs.get(IFLA_IFNAME)
+        name = (
+            fsdecode(bytes(raw_name).rstrip(b"\0"))
+            if raw_name is not None
+            else self._names.get(index)
+        )
+        if name is None:
+            return
+
+        old_name = self._names.get(index)
+
+        if msg_type == RTM_DELLINK:
+            self._names.pop(index, None)
+            self._link_addresses.pop(index, None)
+            yield self._event(NetworkEventType.INTERFACE_REMOVED, old_name or name)
+            return
+
+        if old_name is not None and old_name != name:
+            # Interface was renamed. Reporting the removal of the old name
+            # would make the detector forget the addresses of the interface,
+            # and the kernel does not announce them again for the new name
+            raise _RescanRequired
+
+        self._names[index] = name
+        yield self._event(NetworkEventType.INTERFACE_ADDED, name)
+
+        raw_address = attrs.get(IFLA_ADDRESS)
+        if raw_address:
+            address = raw_address.hex(":")
+            old_address = self._link_addresses.get(index)
+            if old_address is not None and old_address != address:
+                yield self._event(
+                    NetworkEventType.ADDRESS_REMOVED,
+                    name,
+                    LINK_LAYER_FAMILY,
+                    old_address,
+                )
+            self._link_addresses[index] = address
+            yield self._event(
+                NetworkEventType.ADDRESS_ADDED, name, LINK_LAYER_FAMILY, address
+            )
+
+    def _process_messages(self, data: memoryview) -> Iterator[NetworkEvent]:
+        """Processes a buffer containing one or more netlink messages received
+        from the kernel.
+
+        Yields:
+            network events corresponding to the messages; these may be
+            redundant as the detector filters them against its own state
+        """
+        offset, size = 0, len(data)
+        while offset + NLMSGHDR.size <= size:
+            length, msg_type, _flags, _seq, _port = NLMSGHDR.unpack_from(data, offset)
+            if length < NLMSGHDR.size:
+                break
+
+            body, end = offset + NLMSGHDR.size, min(offset + length, size)
+            if msg_type == RTM_NEWADDR or msg_type == RTM_DELADDR:
+                yield from self._process_address_message(msg_type, data, body, end)
+            elif msg_type == RTM_NEWLINK or msg_type == RTM_DELLINK:
+                yield from self._process_link_message(msg_type, data, body, end)
+
+            offset += _align(length)
@@ -3,7 +3,8 @@ continuous polling.
 """
 
 from anyio import sleep
-from typing import Any, Dict, List
+from types import ModuleType
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 from .base import NetworkEventDetectorBackend, NetworkInterface
 
@@ -13,16 +14,30 @@ class PortableNetworkEventDetectorBackend(NetworkEventDetectorBackend):
     continuous polling.
     """
 
+    _netifaces: Optional[ModuleType]
+    """The `netifaces` module; imported lazily when it is first needed."""
+
     def __init__(self):
         """Constructor."""
-        import netifaces
+        self._netifaces = None
 
-        self._netifaces = netifaces
+    async def get_addresses(
+        self, interface: NetworkInterface
+    ) -> Optional[Dict[int, Sequence[Any]]]:
+        try:
+            addresses = self._get_netifaces().ifaddresses(interface)
+        except ValueError:
+            # Interface disappeared since the last scan
+            return None
 
-    async def get_addresses(self, interface: NetworkInterface) -> Dict[int, List[Any]]:
-        addresses = self._netifaces.ifaddresses(interface)
         return {
-            family: [item.get("addr") for item in addr_for_family]
+            family: tuple(
+                sorted(
+                    item["addr"]
+                    for item in addr_for_family
+                    if item.get("addr") is not None
+                )
+            )
             for family, addr_for_family in addresses.items()
         }
 
@@ -30,7 +45,19 @@ class PortableNetworkEventDetectorBackend(NetworkEventDetectorBackend):
         return str(interface)
 
     async def scan(self) -> List[NetworkInterface]:
-        return self._netifaces.interfaces()
+        return self._get_netifaces().interfaces()
+
+    async def scan_keyed(self) -> List[Tuple[str, NetworkInterface]]:
+        # Interfaces are identified by their names, which are also their keys
+        return [(name, name) for name in await self.scan()]
 
     async def wait_until_next_scan(self) -> None:
         await sleep(1)
+
+    def _get_netifaces(self) -> ModuleType:
+        """Returns the `netifaces` module, importing it on first use."""
+        if self._netifaces is None:
+            import netifaces
+
+            self._netifaces = netifaces
+        return self._netifaces
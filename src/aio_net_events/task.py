@@ -2,54 +2,44 @@
 
 from anyio import Event
 from contextlib import contextmanager
-from enum import Enum
+from dataclasses import dataclass
 from typing import (
     Any,
     AsyncIterator,
     Callable,
     Dict,
+    Iterable,
     Iterator,
     List,
-    NamedTuple,
     Optional,
+    Sequence,
     Tuple,
     Union,
 )
 
-from .backends.base import NetworkEventDetectorBackend, NetworkInterface
+from .backends.base import (
+    NetworkEvent,
+    NetworkEventDetectorBackend,
+    NetworkEventType,
+    NetworkInterface,
+)
 from .backends.autodetect import choose_backend
 
 
 __all__ = ("NetworkEventDetector",)
 
 
-class NetworkEventType(Enum):
-    """Enum representing the possible network event types."""
-
-    INTERFACE_ADDED = "interface_added"
-    INTERFACE_REMOVED = "interface_removed"
-    ADDRESS_ADDED = "address_added"
-    ADDRESS_REMOVED = "address_removed"
+@dataclass
+class NetworkEventDetectorEntry:
+    """State of a single network interface as seen by the network event
+    detector.
+    """
 
+    __slots__ = ("interface", "key", "addresses")
 
-NetworkEvent = NamedTuple(
-    "NetworkEvent",
-    [
-        ("type", NetworkEventType),
-        ("interface", NetworkInterface),
-        ("address_family", Optional[int]),
-        ("address", Any),
-        ("key", str),
-    ],
-)
-NetworkEventDetectorEntry = NamedTuple(
-    "NetworkEventDetectorEntry",
-    [
-        ("interface", NetworkInterface),
-        ("key", str),
-        ("addresses", Dict[int, List[Any]]),
-    ],
-)
+    interface: NetworkInterface
+    key: str
+    addresses: Dict[int, Sequence[Any]]
 
 
 class NetworkEventDetector:
@@ -99,9 +89,15 @@ class NetworkEventDetector:
             event objects describing the network addresses that were added and
             the corresponding network interfaces
         """
-        async for event in self.events():
-            if event.type == NetworkEventType.ADDRESS_ADDED:
-                yield event
+        event_type = NetworkEventType.ADDRESS_ADDED
+        batches = self.events_batched()
+        try:
+            async for batch in batches:
+                for event in batch:
+                    if event.type is event_type:
+                        yield event
+        finally:
+            await batches.aclose()
 
     async def added_interfaces(self) -> AsyncIterator[NetworkInterface]:
         """Runs the network event detection in an asynchronous task.
@@ -110,9 +106,15 @@ class NetworkEventDetector:
             network interface objects, one for each interface whose addition was
             detected. Removed network interfaces are not reported.
         """
-        async for event in self.events():
-            if event.type == NetworkEventType.INTERFACE_ADDED:
-                yield event.interface
+        event_type = NetworkEventType.INTERFACE_ADDED
+        batches = self.events_batched()
+        try:
+            async for batch in batches:
+                for event in batch:
+                    if event.type is event_type:
+                        yield event.interface
+        finally:
+            await batches.aclose()
 
     async def changed_addresses(self) -> AsyncIterator[NetworkEvent]:
         """Runs the network event detection in an asynchronous task.
@@ -121,12 +123,16 @@ class NetworkEventDetector:
             event objects describing the network addresses that were added or
             removed and the corresponding network interfaces
         """
-        async for event in self.events():
-            if event.type in (
-                NetworkEventType.ADDRESS_ADDED,
-                NetworkEventType.ADDRESS_REMOVED,
-            ):
-                yield event
+        address_added = NetworkEventType.ADDRESS_ADDED
+        address_removed = NetworkEventType.ADDRESS_REMOVED
+        batches = self.events_batched()
+        try:
+            async for batch in batches:
+                for event in batch:
+                    if event.type is address_added or event.type is address_removed:
+                        yield event
+        finally:
+            await batches.aclose()
 
     async def events(self) -> AsyncIterator[NetworkEvent]:
         """Runs the network event detection in an asynchronous task.
@@ -135,9 +141,30 @@ class NetworkEventDetector:
             event objects describing the network interfaces or addresses that
             were added or removed
         """
+        batches = self.events_batched()
+        try:
+            async for batch in batches:
+                for event in batch:
+                    yield event
+        finally:
+            await batches.aclose()
+
+    async def events_batched(self) -> AsyncIterator[List[NetworkEvent]]:
+        """Runs the network event detection in an asynchronous task, yielding
+        events in batches.
+
+        This is more efficient than `events()` when the consumer is able to
+        process multiple events at once, e.g., when an interface with many
+        addresses is added or removed.
+
+        Yields:
+            non-empty lists of event objects describing the network interfaces
+            or addresses that were added or removed, in the same order as they
+            would be yielded by `events()`
+        """
         backend = self._backend() if callable(self._backend) else self._backend
         backend.configure(self._params)
-        key_of = backend.key_of
+        incremental = backend.supports_incremental
 
         async with backend.use():
             while True:
@@ -145,103 +172,25 @@ class NetworkEventDetector:
                     assert self._resume_event is not None
                     await self._resume_event.wait()
 
-                interfaces = await backend.scan()
-
-                added = {}
-                changed = {}
-
-                for _index, interface in enumerate(interfaces):
-                    addresses = await backend.get_addresses(interface)
-                    key = key_of(interface)
-
-                    entry = self._entries.get(key)
-                    if entry is not None:
-                        changed[key] = self._compare_addresses(entry, addresses)
-                        if any(changed[key]):
-                            self._entries[key] = entry = entry._replace(
-                                addresses=addresses
-                            )
-                    else:
-                        entry = added[key] = NetworkEventDetectorEntry(
-                            interface=interface, addresses=addresses, key=key
-                        )
-
-                to_remove = [key for key in self._entries.keys() if key not in changed]
-                removed = [self._entries.pop(key) for key in to_remove]
-                self._entries.update(added)
-
-                for entry in removed:
-                    interface = entry.interface
-                    key = entry.key
-
-                    for family, addresses in entry.addresses.items():
-                        for address in addresses:
-                            event = NetworkEvent(
-                                type=NetworkEventType.ADDRESS_REMOVED,
-                                interface=interface,
-                                key=key,
-                                address=address,
-                                address_family=family,
-                            )
-                            yield event
-
-                    event = NetworkEvent(
-                        type=NetworkEventType.INTERFACE_REMOVED,
-                        interface=interface,
-                        key=key,
-                        address=None,
-                        address_family=None,
-                    )
-                    yield event
-
-                for key, (added_entries, removed_entries) in changed.items():
-                    for entry in removed_entries:
-                        interface, key, family, address = entry
-                        event = NetworkEvent(
-                            type=NetworkEventType.ADDRESS_REMOVED,
-                            interface=interface,
-                            key=key,
-                            address=address,
-                            address_family=family,
-                        )
-                        yield event
-
-                    for entry in added_entries:
-                        interface, key, family, address = entry
-                        event = NetworkEvent(
-                            type=NetworkEventType.ADDRESS_ADDED,
-                            interface=interface,
-                            key=key,
-                            address=address,
-                            address_family=family,
-                        )
-                        yield event
-
-                for entry in added.values():
-                    interface = entry.interface
-                    key = entry.key
-
-                    event = NetworkEvent(
-                        type=NetworkEventType.INTERFACE_ADDED,
-                        interface=interface,
-                        key=key,
-                        address=None,
-                        address_family=None,
-                    )
-                    yield event
-
-                    for family, addresses in entry.addresses.items():
-                        for address in addresses:
-                            event = NetworkEvent(
-                                type=NetworkEventType.ADDRESS_ADDED,
-                                interface=interface,
-                                key=key,
-                                address=address,
-                                address_family=family,
-                            )
-                            yield event
-
-                await backend.wait_until_next_scan()
+                batch = await self._rescan(backend)
+                if batch:
+                    yield batch
+
+                if incremental:
+                    changes = backend.events()
+                    try:
+                        async for change in changes:
+                            if self._suspended:
+                                # The change will be picked up by the next
+                                # full scan after the detector is resumed
+                                break
+                            batch = list(self._apply_change(change))
+                            if batch:
+                                yield batch
+                    finally:
+                        await changes.aclose()
+                else:
+                    await backend.wait_until_next_scan()
 
     async def removed_addresses(self) -> AsyncIterator[NetworkEvent]:
         """Runs the network event detection in an asynchronous task.
@@ -250,9 +199,15 @@ class NetworkEventDetector:
             event objects describing the network addresses that were removed and
             the corresponding network interfaces
         """
-        async for event in self.events():
-            if event.type == NetworkEventType.ADDRESS_REMOVED:
-                yield event
+        event_type = NetworkEventType.ADDRESS_REMOVED
+        batches = self.events_batched()
+        try:
+            async for batch in batches:
+                for event in batch:
+                    if event.type is event_type:
+                        yield event
+        finally:
+            await batches.aclose()
 
     async def removed_interfaces(self) -> AsyncIterator[NetworkEvent]:
         """Runs the network event detection in an asynchronous task.
@@ -261,9 +216,15 @@ class NetworkEventDetector:
             network interface objects, one for each interface whose removal was
             detected. Added interfaces are not reported.
         """
-        async for event in self.events():
-            if event.type == NetworkEventType.INTERFACE_REMOVED:
-                yield event.interface
+        event_type = NetworkEventType.INTERFACE_REMOVED
+        batches = self.events_batched()
+        try:
+            async for batch in batches:
+                for event in batch:
+                    if event.type is event_type:
+                        yield event.interface
+        finally:
+            await batches.aclose()
 
     def resume(self) -> None:
         """Resumes the network event detector task after a suspension."""
@@ -288,9 +249,69 @@ class NetworkEventDetector:
         finally:
             self.resume()
 
+    def _apply_change(self, change: NetworkEvent) -> Iterable[NetworkEvent]:
+        """Applies a single change reported by an incremental backend to the
+        state of the detector.
+
+        Parameters:
+            change: the change reported by the backend
+
+        Yields:
+            the events that need to be dispatched as a consequence of the
+            change; changes that do not modify the state of the detector are
+            ignored
+        """
+        address_added = NetworkEventType.ADDRESS_ADDED
+        address_removed = NetworkEventType.ADDRESS_REMOVED
+        interface_added = NetworkEventType.INTERFACE_ADDED
+        interface_removed = NetworkEventType.INTERFACE_REMOVED
+
+        key = change.key
+        event_type = change.type
+        entry = self._entries.get(key)
+
+        if event_type is interface_removed:
+            if entry is None:
+                return
+
+            del self._entries[key]
+            for family, addresses in entry.addresses.items():
+                for address in addresses:
+                    yield NetworkEvent(
+                        address_removed, entry.interface, family, address, key
+                    )
+            yield change
+            return
+
+        if entry is None:
+            if event_type is address_removed:
+                return
+
+            entry = self._entries[key] = NetworkEventDetectorEntry(
+                interface=change.interface, addresses={}, key=key
+            )
+            yield NetworkEvent(interface_added, change.interface, None, None, key)
+
+        if event_type is address_added:
+            family, address = change.address_family, change.address
+            addresses = entry.addresses.get(family, ())
+            if address not in addresses:
+                entry.addresses[family] = tuple(sorted((*addresses, address)))
+                yield change
+        elif event_type is address_removed:
+            family, address = change.address_family, change.address
+            addresses = entry.addresses.get(family, ())
+            if address in addresses:
+                remaining = tuple(item for item in addresses if item != address)
+                if remaining:
+                    entry.addresses[family] = remaining
+                else:
+                    del entry.addresses[family]
+                yield change
+
     @staticmethod
     def _compare_addresses(
-        entry: NetworkEventDetectorEntry, new: Dict[int, List[Any]]
+        entry: NetworkEventDetectorEntry, new: Dict[int, Sequence[Any]]
     ) -> Tuple:
         """Compares a set of old addresses with a set of new addresses for a
         network interface, and reports the differences.
@@ -306,10 +327,13 @@ class NetworkEventDetector:
             items: interface, key of interface, address family and address
         """
         old = entry.addresses
+        if old == new:
+            # Nothing changed; this is the most common case
+            return [], []
 
         added, removed = [], []
 
-        for family in set(list(old.keys()) + list(new.keys())):
+        for family in old.keys() | new.keys():
             old_addresses = old.get(family)
             new_addresses = new.get(family)
 
@@ -329,6 +353,15 @@ class NetworkEventDetector:
                     (entry.interface, entry.key, family, address)
                     for address in old_addresses
                 )
+            elif len(old_addresses) == 1 and len(new_addresses) == 1:
+                # Single address on both sides; no need for sets. The
+                # addresses may still be the same if one side is a list and
+                # the other one is a tuple
+                if old_addresses[0] != new_addresses[0]:
+                    added.append((entry.interface, entry.key, family, new_addresses[0]))
+                    removed.append(
+                        (entry.interface, entry.key, family, old_addresses[0])
+                    )
             else:
                 old_addresses, new_addresses = set(old_addresses), set(new_addresses)
                 added.extend(
@@ -355,3 +388,89 @@ class NetworkEventDetector:
             the same dictionary that was passed in
         """
         return params
+
+    async def _rescan(self, backend: NetworkEventDetectorBackend) -> List[NetworkEvent]:
+        """Scans all the network interfaces using the given backend and compares
+        the results with the state of the detector.
+
+        Parameters:
+            backend: the backend to use for scanning
+
+        Returns:
+            the list of events describing the differences between the old and
+            the new state
+        """
+        address_added = NetworkEventType.ADDRESS_ADDED
+        address_removed = NetworkEventType.ADDRESS_REMOVED
+        interface_added = NetworkEventType.INTERFACE_ADDED
+        interface_removed = NetworkEventType.INTERFACE_REMOVED
+
+        entries = self._entries
+        interfaces = dict(await backend.scan_keyed())
+        result = []
+
+        # Not using a set difference here because the order of its items
+        # would depend on the hash seed and we want deterministic events
+        removed = [entry for key, entry in entries.items() if key not in interfaces]
+        for entry in removed:
+            del entries[entry.key]
+        added = []
+        changed = []
+
+        for key, interface in interfaces.items():
+            addresses = await backend.get_addresses(interface)
+            entry = entries.get(key)
+
+            if addresses is None:
+                # Interface disappeared since the scan
+                if entry is not None:
+                    removed.append(entries.pop(key))
+            elif entry is None:
+                entry = entries[key] = NetworkEventDetectorEntry(
+                    interface=interface, addresses=addresses, key=key
+                )
+                added.append(entry)
+            else:
+                changes = self._compare_addresses(entry, addresses)
+                if changes[0] or changes[1]:
+                    entry.addresses = addresses
+                    changed.append(changes)
+
+        for entry in removed:
+            interface = entry.interface
+            key = entry.key
+
+            for family, addresses in entry.addresses.items():
+                for address in addresses:
+                    result.append(
+                        NetworkEvent(address_removed, interface, family, address, key)
+                    )
+
+            result.append(NetworkEvent(interface_removed, interface, None, None, key))
+
+        for added_entries, removed_entries in changed:
+            for entry in removed_entries:
+                interface, key, family, address = entry
+                result.append(
+                    NetworkEvent(address_removed, interface, family, address, key)
+                )
+
+            for entry in added_entries:
+                interface, key, family, address = entry
+                result.append(
+                    NetworkEvent(address_added, interface, family, address, key)
+                )
+
+        for entry in added:
+            interface = entry.interface
+            key = entry.key
+
+            result.append(NetworkEvent(interface_added, interface, None, None, key))
+
+            for family, addresses in entry.addresses.items():
+                for address in addresses:
+                    result.append(
+                        NetworkEvent(address_added, interface, family, address, key)
+                    )
+
+        return result
@@ -1,18 +1,19 @@
+import platform
+
 from aio_net_events import choose_backend
 from pathlib import Path
 
 
 def test_autodetection():
-    import platform
-
     backend = choose_backend()
+    system = platform.system()
 
-    if platform.system() == "Darwin":
+    if system == "Darwin":
         assert (
             backend.__class__.__name__
             == "SystemConfigurationBasedNetworkEventDetectorBackend"
         )
-    elif platform.system() == "Linux" and Path("/proc/net/netlink").exists():
+    elif system == "Linux" and Path("/proc/net/netlink").exists():
         assert backend.__class__.__name__ == "NetlinkBasedNetworkEventDetectorBackend"
     else:
         assert backend.__class__.__name__ == "PortableNetworkEventDetectorBackend"
@@ -0,0 +1,322 @@
+import socket
+
+from anyio.lowlevel import checkpoint
+from collections import deque
+from errno import ENOBUFS
+from pytest import fixture, mark, skip
+from types import SimpleNamespace
+from typing import Deque, Union
+
+from aio_net_events.backends.base import NetworkEvent, NetworkEventType
+
+if not hasattr(socket, "AF_NETLINK"):
+    skip("netlink sockets are not supported", allow_module_level=True)
+
+from aio_net_events.backends import netlink
+from aio_net_events.backends.netlink import (
+    IFA_ADDRESS,
+    IFA_LOCAL,
+    IFADDRMSG,
+    IFINFOMSG,
+    IFLA_ADDRESS,
+    IFLA_IFNAME,
+    NLMSGHDR,
+    RTATTR,
+    RTM_DELADDR,
+    RTM_DELLINK,
+    RTM_NEWADDR,
+    RTM_NEWLINK,
+    NetlinkBasedNetworkEventDetectorBackend,
+)
+
+AF_INET, AF_INET6 = int(socket.AF_INET), int(socket.AF_INET6)
+
+
+class SocketExhausted(Exception):
+    """Raised when the backend waits for a fake socket that has no more data
+    to return, instead of blocking forever.
+    """
+
+
+class FakeSocket:
+    """Fake netlink socket that returns a predefined sequence of datagrams,
+    or raises a predefined sequence of errors, from `recv_into()`.
+    """
+
+    def __init__(self, *items: Union[bytes, Exception]):
+        self._items: Deque[Union[bytes, Exception]] = deque(items)
+
+    def close(self) -> None:
+        pass
+
+    async def wait_readable(self) -> None:
+        if not self._items:
+            raise SocketExhausted
+        await checkpoint()
+
+    def recv_into(self, buffer, size: int, flags: int) -> int:
+        if not self._items:
+            raise BlockingIOError
+
+        item = self._items.popleft()
+        if isinstance(item, Exception):
+            raise item
+
+        buffer[: len(item)] = item
+        return len(item)
+
+
+def attribute(attr_type: int, payload: bytes) -> bytes:
+    """Packs a routing attribute, including the padding after its payload."""
+    length = RTATTR.size + len(payload)
+    padding = b"\0" * (-length % 4)
+    return RTATTR.pack(length, attr_type) + payload + padding
+
+
+def message(msg_type: int, body: bytes, *attributes: bytes) -> bytes:
+    """Packs a netlink message with the given type, body and attributes."""
+    payload = body + b"".join(attributes)
+    return NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type, 0, 0, 0) + payload
+
+
+def link_message(msg_type: int, index: int, name: str, mac: str = "") -> bytes:
+    """Packs an RTM_NEWLINK or RTM_DELLINK message."""
+    attributes = [attribute(IFLA_IFNAME, name.encode() + b"\0")]
+    if mac:
+        attributes.append(attribute(IFLA_ADDRESS, bytes.fromhex(mac.replace(":", ""))))
+    return message(msg_type, IFINFOMSG.pack(0, 1, index, 0, 0), *attributes)
+
+
+def address_message(
+    msg_type: int,
+    family: int,
+    index: int,
+    local: str = "",
+    address: str = "",
+) -> bytes:
+    """Packs an RTM_NEWADDR or RTM_DELADDR message."""
+    attributes = []
+    if address:
+        attributes.append(attribute(IFA_ADDRESS, socket.inet_pton(family, address)))
+    if local:
+        attributes.append(attribute(IFA_LOCAL, socket.inet_pton(family, local)))
+    return message(msg_type, IFADDRMSG.pack(family, 24, 0, 0, index), *attributes)
+
+
+def process(backend, *messages: bytes):
+    """Feeds the given messages to the backend as a single datagram and
+    returns the events that the backend derived from them.
+    """
+    return list(backend._process_messages(memoryview(b"".join(messages))))
+
+
+async def receive(backend, *items: Union[bytes, Exception]):
+    """Makes the backend receive the given datagrams or errors from its socket.
+
+    Returns:
+        the events that the `events()` generator of the backend yielded, and
+        whether the generator ended on its own before consuming all the items
+    """
+    backend._socket.close()
+    backend._socket = FakeSocket(*items)
+
+    result = []
+    changes = backend.events()
+    try:
+        async for change in changes:
+            result.append(change)
+    except SocketExhausted:
+        return result, False
+    finally:
+        await changes.aclose()
+    return result, True
+
+
+def event(event_type, interface, family=None, address=None):
+    return NetworkEvent(event_type, interface, family, address, interface)
+
+
+@fixture
+def backend(monkeypatch):
+    async def wait_socket_readable(sock):
+        await sock.wait_readable()
+
+    monkeypatch.setattr(netlink, "if_nameindex", lambda: [(1, "lo"), (2, "eth0")])
+    monkeypatch.setattr(netlink, "wait_socket_readable", wait_socket_readable)
+
+    backend = NetlinkBasedNetworkEventDetectorBackend()
+    addresses = {
+        "lo": {17: [{"addr": "00:00:00:00:00:00"}]},
+        "eth0": {17: [{"addr": "02:aa:bb:cc:dd:ee"}], 2: [{"addr": "192.0.2.2"}]},
+    }
+    backend._netifaces = SimpleNamespace(
+        interfaces=lambda: list(addresses), ifaddresses=addresses.__getitem__
+    )
+    return backend
+
+
+@mark.anyio
+async def test_link_address_change_after_scan(backend):
+    for interface in await backend.scan():
+        await backend.get_addresses(interface)
+
+    assert process(
+        backend, link_message(RTM_NEWLINK, 2, "eth0", "02:fc:00:00:00:01")
+    ) == [
+        event(NetworkEventType.INTERFACE_ADDED, "eth0"),
+        event(NetworkEventType.ADDRESS_REMOVED, "eth0", 17, "02:aa:bb:cc:dd:ee"),
+        event(NetworkEventType.ADDRESS_ADDED, "eth0", 17, "02:fc:00:00:00:01"),
+    ]
+
+
+@mark.anyio
+async def test_rename_requires_rescan(backend):
+    await backend.scan()
+
+    assert await receive(
+        backend,
+        link_message(RTM_NEWLINK, 1, "lo"),
+        link_message(RTM_NEWLINK, 2, "wan0", "02:aa:bb:cc:dd:ee"),
+        link_message(RTM_NEWLINK, 1, "lo"),
+    ) == ([event(NetworkEventType.INTERFACE_ADDED, "lo")], True)
+
+
+def test_new_link(backend):
+    events = process(backend, link_message(RTM_NEWLINK, 3, "usb0", "02:00:00:00:00:03"))
+    assert events == [
+        event(NetworkEventType.INTERFACE_ADDED, "usb0"),
+        event(NetworkEventType.ADDRESS_ADDED, "usb0", 17, "02:00:00:00:00:03"),
+    ]
+
+    # Link-layer addresses must use the same type for the address family as
+    # the ones reported by netifaces during a scan
+    assert type(events[1].address_family) is int
+
+
+@mark.anyio
+async def test_address_messages(backend):
+    await backend.scan()
+
+    # Multiple messages in the same datagram
+    assert process(
+        backend,
+        address_message(RTM_NEWADDR, AF_INET, 2, local="192.0.2.3"),
+        address_message(RTM_DELADDR, AF_INET, 2, local="192.0.2.2"),
+    ) == [
+        event(NetworkEventType.ADDRESS_ADDED, "eth0", AF_INET, "192.0.2.3"),
+        event(NetworkEventType.ADDRESS_REMOVED, "eth0", AF_INET, "192.0.2.2"),
+    ]
+
+    # IFA_ADDRESS is the address of the peer on point-to-point links and it is
+    # used only if there is no IFA_LOCAL
+    assert process(
+        backend,
+        address_message(
+            RTM_NEWADDR, AF_INET, 2, local="192.0.2.9", address="198.51.100.1"
+        ),
+        address_message(RTM_NEWADDR, AF_INET, 2, address="192.0.2.10"),
+    ) == [
+        event(NetworkEventType.ADDRESS_ADDED, "eth0", AF_INET, "192.0.2.9"),
+        event(NetworkEventType.ADDRESS_ADDED, "eth0", AF_INET, "192.0.2.10"),
+    ]
+
+    # Link-local IPv6 addresses have the name of the interface appended, just
+    # like in the output of netifaces
+    assert process(
+        backend,
+        address_message(RTM_NEWADDR, AF_INET6, 2, address="fe80::1"),
+        address_message(RTM_NEWADDR, AF_INET6, 2, address="2001:db8::1"),
+    ) == [
+        event(NetworkEventType.ADDRESS_ADDED, "eth0", AF_INET6, "fe80::1%eth0"),
+        event(NetworkEventType.ADDRESS_ADDED, "eth0", AF_INET6, "2001:db8::1"),
+    ]
+
+    # Messages without an address or with other address families are ignored
+    assert (
+        process(
+            backend,
+            address_message(RTM_NEWADDR, AF_INET, 2),
+            message(RTM_NEWADDR, IFADDRMSG.pack(17, 0, 0, 0, 2)),
+        )
+        == []
+    )
+
+
+@mark.anyio
+async def test_address_of_unknown_interface(backend, monkeypatch):
+    def if_indextoname(index):
+        if index == 5:
+            return "tun0"
+        raise OSError("no such device")
+
+    monkeypatch.setattr(netlink, "if_indextoname", if_indextoname)
+    await backend.scan()
+
+    assert process(
+        backend,
+        address_message(RTM_NEWADDR, AF_INET, 5, local="10.8.0.1"),
+        address_message(RTM_NEWADDR, AF_INET, 6, local="10.9.0.1"),
+    ) == [event(NetworkEventType.ADDRESS_ADDED, "tun0", AF_INET, "10.8.0.1")]
+
+
+@mark.anyio
+async def test_link_messages(backend):
+    await backend.scan()
+
+    assert process(
+        backend,
+        link_message(RTM_NEWLINK, 3, "usb0", "02:00:00:00:00:03"),
+        link_message(RTM_NEWLINK, 3, "usb0", "02:00:00:00:00:03"),
+        link_message(RTM_NEWLINK, 3, "usb0", "02:00:00:00:00:04"),
+        link_message(RTM_DELLINK, 3, "usb0", "02:00:00:00:00:04"),
+    ) == [
+        event(NetworkEventType.INTERFACE_ADDED, "usb0"),
+        event(NetworkEventType.ADDRESS_ADDED, "usb0", 17, "02:00:00:00:00:03"),
+        event(NetworkEventType.INTERFACE_ADDED, "usb0"),
+        event(NetworkEventType.ADDRESS_ADDED, "usb0", 17, "02:00:00:00:00:03"),
+        event(NetworkEventType.INTERFACE_ADDED, "usb0"),
+        event(NetworkEventType.ADDRESS_REMOVED, "usb0", 17, "02:00:00:00:00:03"),
+        event(NetworkEventType.ADDRESS_ADDED, "usb0", 17, "02:00:00:00:00:04"),
+        event(NetworkEventType.INTERFACE_REMOVED, "usb0"),
+    ]
+
+
+@mark.anyio
+async def test_truncated_datagram(backend):
+    await backend.scan()
+
+    data = address_message(RTM_NEWADDR, AF_INET, 2, local="192.0.2.3")
+    truncated = link_message(RTM_NEWLINK, 3, "usb0", "02:00:00:00:00:03")[:-6]
+    assert process(backend, data, truncated) == [
+        event(NetworkEventType.ADDRESS_ADDED, "eth0", AF_INET, "192.0.2.3"),
+        event(NetworkEventType.INTERFACE_ADDED, "usb0"),
+    ]
+
+
+@mark.anyio
+async def test_events(backend):
+    await backend.scan()
+
+    assert await receive(
+        backend,
+        address_message(RTM_NEWADDR, AF_INET, 2, local="192.0.2.3"),
+        address_message(RTM_DELADDR, AF_INET, 2, local="192.0.2.3"),
+    ) == (
+        [
+            event(NetworkEventType.ADDRESS_ADDED, "eth0", AF_INET, "192.0.2.3"),
+            event(NetworkEventType.ADDRESS_REMOVED, "eth0", AF_INET, "192.0.2.3"),
+        ],
+        False,
+    )
+
+
+@mark.anyio
+async def test_dropped_messages_require_rescan(backend):
+    await backend.scan()
+
+    assert await receive(
+        backend,
+        address_message(RTM_NEWADDR, AF_INET, 2, local="192.0.2.3"),
+        OSError(ENOBUFS, "No buffer space available"),
+        address_message(RTM_DELADDR, AF_INET, 2, local="192.0.2.3"),
+    ) == ([event(NetworkEventType.ADDRESS_ADDED, "eth0", AF_INET, "192.0.2.3")], True)
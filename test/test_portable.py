@@ -0,0 +1,42 @@
+from pytest import fixture, importorskip, mark
+
+from aio_net_events.backends.portable import PortableNetworkEventDetectorBackend
+
+netifaces = importorskip("netifaces")
+
+
+@fixture
+def backend(monkeypatch):
+    addresses = {
+        "eth0": {
+            2: [
+                {"addr": "192.0.2.9", "netmask": "255.255.255.0"},
+                {"addr": "192.0.2.2", "netmask": "255.255.255.0"},
+            ],
+            10: [{"addr": "fe80::1%eth0"}, {"netmask": "ffff::"}, {"addr": None}],
+            17: [{"addr": "02:aa:bb:cc:dd:ee", "broadcast": "ff:ff:ff:ff:ff:ff"}],
+        },
+    }
+
+    def ifaddresses(interface):
+        try:
+            return addresses[interface]
+        except KeyError:
+            raise ValueError("You must specify a valid interface name.") from None
+
+    monkeypatch.setattr(netifaces, "ifaddresses", ifaddresses)
+    return PortableNetworkEventDetectorBackend()
+
+
+@mark.anyio
+async def test_get_addresses(backend):
+    assert await backend.get_addresses("eth0") == {
+        2: ("192.0.2.2", "192.0.2.9"),
+        10: ("fe80::1%eth0",),
+        17: ("02:aa:bb:cc:dd:ee",),
+    }
+
+
+@mark.anyio
+async def test_get_addresses_of_vanished_interface(backend):
+    assert await backend.get_addresses("eth1") is None
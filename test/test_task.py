@@ -1,19 +1,35 @@
 from aio_net_events import NetworkEventDetector
-from aio_net_events.backends.base import NetworkEventDetectorBackend
-from anyio import CancelScope, create_task_group, sleep
-from collections import defaultdict
+from aio_net_events.backends.base import (
+    NetworkEvent,
+    NetworkEventDetectorBackend,
+    NetworkEventType,
+)
+from aio_net_events.task import NetworkEventDetectorEntry
+from anyio import (
+    Event,
+    WouldBlock,
+    create_memory_object_stream,
+    create_task_group,
+    wait_all_tasks_blocked,
+)
+from contextlib import asynccontextmanager
+from operator import attrgetter
 from pytest import fixture, mark
-from typing import Dict, List, Optional
+from types import SimpleNamespace
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
 
 
 class MockBackend(NetworkEventDetectorBackend):
     """Mock backend for testing without having access to real network
     interfaces.
+
+    Each modification of the mock network configuration increments a version
+    number. The `drained()` method can be used to wait until the detector has
+    processed all the modifications up to the current version.
     """
 
     def __init__(self):
-        self._interfaces = defaultdict(lambda: defaultdict(list))
-        self.params = {}
+        self.reset()
 
     def add(
         self,
@@ -21,24 +37,51 @@ class MockBackend(NetworkEventDetectorBackend):
         family: Optional[int] = None,
         address: Optional[str] = None,
     ) -> None:
+        if interface not in self._interfaces:
+            self._keys.setdefault(interface, interface + "_key")
+            self._sorted_interfaces = None
+
+        self._interfaces.add(interface)
         if family is not None:
-            # Add the address
-            addresses = self._interfaces[interface][family]
-            if address not in addresses:
-                addresses.append(address)
-        else:
-            # Just trigger the creation of the interface
-            self._interfaces[interface]
+            self._addresses.setdefault((interface, family), {})[address] = None
+            self._touch_addresses(interface)
+        self._touch()
 
     def configure(self, params):
-        self.params = dict(params)
-
-    async def get_addresses(self, interface: str) -> Dict[int, List[str]]:
-        result = self._interfaces.get(interface, None)
-        return {k: list(v) for k, v in result.items()} if result else {}
+        # The detector guarantees that nobody else holds a reference to params
+        self.params = params
+
+    async def drained(self) -> None:
+        """Waits until the detector has processed all the modifications of the
+        mock network configuration made so far.
+        """
+        while self._processed_version < self._version:
+            self._idle = Event()
+            await self._idle.wait()
+
+    async def get_addresses(self, interface: str) -> Dict[int, Tuple[str, ...]]:
+        version = self._address_versions.get(interface, 0)
+        cached = self._address_cache.get(interface)
+        if cached is None or cached[0] != version:
+            cached = self._address_cache[interface] = (
+                version,
+                {
+                    family: tuple(addresses)
+                    for (name, family), addresses in self._addresses.items()
+                    if name == interface
+                },
+            )
+
+        # The caller is allowed to modify the dict that we return so we must
+        # not hand out the cached one; the tuples are immutable so they are
+        # shared
+        return dict(cached[1])
 
     def key_of(self, interface: str) -> str:
-        return interface + "_key"
+        key = self._keys.get(interface)
+        if key is None:
+            key = self._keys[interface] = interface + "_key"
+        return key
 
     def remove(
         self,
@@ -47,91 +90,259 @@ class MockBackend(NetworkEventDetectorBackend):
         address: Optional[str] = None,
     ) -> None:
         if family is None:
-            del self._interfaces[interface]
+            self._interfaces.remove(interface)
+            for key in [key for key in self._addresses if key[0] == interface]:
+                del self._addresses[key]
+            self._keys.pop(interface, None)
+            self._sorted_interfaces = None
+            self._address_versions.pop(interface, None)
+            self._address_cache.pop(interface, None)
         else:
-            self._interfaces[interface][family].remove(address)
-            if not self._interfaces[interface][family]:
-                del self._interfaces[interface][family]
+            addresses = self._addresses.get((interface, family))
+            if addresses is not None:
+                addresses.pop(address, None)
+                if not addresses:
+                    del self._addresses[interface, family]
+                self._touch_addresses(interface)
+        self._touch()
+
+    def reset(self) -> None:
+        """Resets the mock network configuration to its initial, empty state
+        so the same backend can be reused by multiple tests.
+        """
+        self._interfaces: Set[str] = set()
+
+        # Addresses are stored in dicts to get O(1) membership checks while
+        # preserving insertion order
+        self._addresses: Dict[Tuple[str, int], Dict[str, None]] = {}
+        self.params = {}
+
+        # Keys of the interfaces, calculated once per interface
+        self._keys: Dict[str, str] = {}
+
+        # Sorted list of interface names; None if it needs to be recalculated
+        self._sorted_interfaces: Optional[List[str]] = None
+
+        # Per-interface version numbers of the addresses, and the result of
+        # the last get_addresses() call for each interface with the version
+        # number it was calculated for
+        self._address_versions: Dict[str, int] = {}
+        self._address_cache: Dict[str, Tuple[int, Dict[int, Tuple[str, ...]]]] = {}
+
+        self._version = 0
+        self._scanned_version = -1
+        self._processed_version = -1
+
+        self._changed: Optional[Event] = None
+        self._idle: Optional[Event] = None
 
     async def scan(self) -> List[str]:
-        await sleep(0.001)
-        return sorted(self._interfaces)
+        self._scanned_version = self._version
+        if self._sorted_interfaces is None:
+            self._sorted_interfaces = sorted(self._interfaces)
+        return list(self._sorted_interfaces)
 
     async def wait_until_next_scan(self) -> None:
-        await sleep(0.001)
+        self._mark_processed(self._scanned_version)
+        if self._scanned_version == self._version:
+            self._changed = Event()
+            await self._changed.wait()
+        self._changed = None
+
+    def _mark_processed(self, version: int) -> None:
+        """Records that the detector has processed all the modifications up to
+        the given version and wakes up the task waiting in `drained()`.
+        """
+        self._processed_version = version
+        if self._idle is not None:
+            self._idle.set()
+
+    def _touch(self) -> None:
+        """Records a modification of the mock network configuration."""
+        self._version += 1
+        if self._changed is not None:
+            self._changed.set()
+
+    def _touch_addresses(self, interface: str) -> None:
+        """Records a modification of the addresses of the given interface."""
+        self._address_versions[interface] = self._address_versions.get(interface, 0) + 1
+
+
+class IncrementalMockBackend(MockBackend):
+    """Mock backend that reports changes incrementally, with an explicit method
+    to post a change as if it was reported by the OS.
+    """
 
+    supports_incremental = True
 
-@fixture
-def backend():
+    def __init__(self):
+        super().__init__()
+        self._tx, self._rx = create_memory_object_stream(16)
+
+    async def events(self) -> AsyncIterator[NetworkEvent]:
+        while True:
+            try:
+                event = self._rx.receive_nowait()
+            except WouldBlock:
+                # All the posted changes have been processed by now
+                self._mark_processed(self._version)
+                event = await self._rx.receive()
+            yield event
+
+    def post(
+        self,
+        type: NetworkEventType,
+        interface: str,
+        family: Optional[int] = None,
+        address: Optional[str] = None,
+    ) -> None:
+        event = NetworkEvent(
+            type=type,
+            interface=interface,
+            key=self.key_of(interface),
+            address_family=family,
+            address=address,
+        )
+        self._tx.send_nowait(event)
+        self._touch()
+
+
+class LifecycleTrackingMockBackend(MockBackend):
+    """Mock backend that records whether the detector is currently using it."""
+
+    in_use: bool = False
+
+    @asynccontextmanager
+    async def use(self) -> AsyncIterator[None]:
+        self.in_use = True
+        try:
+            yield
+        finally:
+            self.in_use = False
+
+
+def create_event_collector() -> SimpleNamespace:
+    """Creates an object that collects the items yielded by the detector in a
+    test scenario.
+    """
+    items = []
+
+    def get():
+        result = items[:]
+        items.clear()
+        return result
+
+    def get_set():
+        """Returns the collected items as a set, for comparisons where the
+        order of the items is irrelevant. Fails if an item was collected more
+        than once.
+        """
+        collected = get()
+        result = set(collected)
+        assert len(result) == len(collected), f"duplicate items in {collected!r}"
+        return result
+
+    return SimpleNamespace(
+        add=items.append, get=get, get_set=get_set, reset=items.clear
+    )
+
+
+@fixture(scope="module")
+def shared_backend():
     return MockBackend()
 
 
+@fixture(scope="module")
+def shared_events():
+    return create_event_collector()
+
+
+@fixture
+def backend(shared_backend):
+    shared_backend.reset()
+    return shared_backend
+
+
 @fixture
-def events():
-    class EventCollector:
-        def __init__(self):
-            self._items = []
+def events(shared_events):
+    shared_events.reset()
+    return shared_events
+
+
+_event_fields = attrgetter("type", "interface", "key", "address_family", "address")
+
 
-        def add(self, event):
-            self._items.append(event)
+def _as_tuple(event):
+    """Converts a network event into a plain tuple for easier comparison."""
+    event_type, interface, key, family, address = _event_fields(event)
+    return (event_type.value, interface, key, family, address)
 
-        def get(self):
-            result = list(self._items)
-            self._items.clear()
-            return result
 
-    return EventCollector()
+async def _run_scenario(generator, scenario, collect):
+    """Runs a test scenario concurrently with a consumer that passes each item
+    of the given async generator to a collector function. The consumer is
+    stopped when the scenario returns.
+    """
+
+    async def consume():
+        async for item in generator:
+            collect(item)
+
+    async with create_task_group() as tg:
+        tg.start_soon(consume)
+        await scenario()
+        tg.cancel_scope.cancel()
 
 
 @mark.anyio
 async def test_event_generator(backend, events):
     scanner = NetworkEventDetector(backend=backend)
 
-    async def scenario(end):
+    async def scenario():
         backend.add("foo")
-        await sleep(0.003)
+        await backend.drained()
         assert events.get() == [("interface_added", "foo", "foo_key", None, None)]
 
         backend.add("bar")
         backend.add("bar")
         backend.add("bar")
-        await sleep(0.003)
+        await backend.drained()
         assert events.get() == [("interface_added", "bar", "bar_key", None, None)]
 
         backend.remove("bar")
         backend.add("baz")
-        await sleep(0.003)
-        assert sorted(events.get()) == [
+        await backend.drained()
+        assert events.get_set() == {
             ("interface_added", "baz", "baz_key", None, None),
             ("interface_removed", "bar", "bar_key", None, None),
-        ]
+        }
 
         backend.add("foo", 18, "de:ad:be:ef:00:00")
-        await sleep(0.003)
+        await backend.drained()
         assert events.get() == [
             ("address_added", "foo", "foo_key", 18, "de:ad:be:ef:00:00")
         ]
 
         backend.add("foo", 18, "de:ad:be:ef:00:00")
-        await sleep(0.003)
-        assert sorted(events.get()) == []
+        await backend.drained()
+        assert events.get() == []
 
         backend.remove("foo", 18, "de:ad:be:ef:00:00")
-        await sleep(0.003)
+        await backend.drained()
         assert events.get() == [
             ("address_removed", "foo", "foo_key", 18, "de:ad:be:ef:00:00")
         ]
 
         backend.remove("foo")
         backend.remove("baz")
-        await sleep(0.003)
-        assert sorted(events.get()) == [
+        await backend.drained()
+        assert events.get_set() == {
             ("interface_removed", "baz", "baz_key", None, None),
             ("interface_removed", "foo", "foo_key", None, None),
-        ]
+        }
 
         backend.add("foo", 18, "de:ad:be:ef:00:00")
-        await sleep(0.003)
+        await backend.drained()
         assert events.get() == [
             ("interface_added", "foo", "foo_key", None, None),
             ("address_added", "foo", "foo_key", 18, "de:ad:be:ef:00:00"),
@@ -139,145 +350,287 @@ async def test_event_generator(backend, events):
 
         backend.remove("foo", 18, "de:ad:be:ef:00:00")
         backend.add("foo", 18, "de:ad:be:ef:ca:fe")
-        await sleep(0.003)
+        await backend.drained()
         assert events.get() == [
             ("address_removed", "foo", "foo_key", 18, "de:ad:be:ef:00:00"),
             ("address_added", "foo", "foo_key", 18, "de:ad:be:ef:ca:fe"),
         ]
 
         backend.remove("foo")
-        await sleep(0.003)
+        await backend.drained()
         assert events.get() == [
             ("address_removed", "foo", "foo_key", 18, "de:ad:be:ef:ca:fe"),
             ("interface_removed", "foo", "foo_key", None, None),
         ]
 
-        end()
+    await _run_scenario(
+        scanner.events(), scenario, lambda event: events.add(_as_tuple(event))
+    )
 
-    async with create_task_group() as tg:
-        with CancelScope() as scope:
-            tg.start_soon(scenario, scope.cancel)
-            async for event in scanner.events():
-                events.add(
-                    (
-                        event.type.value,
-                        event.interface,
-                        event.key,
-                        event.address_family,
-                        event.address,
-                    )
-                )
+
+@mark.anyio
+async def test_batched_event_generator(backend, events):
+    scanner = NetworkEventDetector(backend=backend)
+
+    async def scenario():
+        backend.add("foo", 2, "10.0.0.1")
+        backend.add("foo", 2, "10.0.0.2")
+        await backend.drained()
+        assert events.get() == [
+            [
+                ("interface_added", "foo", None, None),
+                ("address_added", "foo", 2, "10.0.0.1"),
+                ("address_added", "foo", 2, "10.0.0.2"),
+            ]
+        ]
+
+        backend.remove("foo")
+        await backend.drained()
+        assert events.get() == [
+            [
+                ("address_removed", "foo", 2, "10.0.0.1"),
+                ("address_removed", "foo", 2, "10.0.0.2"),
+                ("interface_removed", "foo", None, None),
+            ]
+        ]
+
+    def collect(batch):
+        events.add(
+            [
+                (event.type.value, event.interface, event.address_family, event.address)
+                for event in batch
+            ]
+        )
+
+    await _run_scenario(scanner.events_batched(), scenario, collect)
+
+
+@mark.anyio
+async def test_event_generator_incremental(events):
+    backend = IncrementalMockBackend()
+    backend.add("foo", 18, "de:ad:be:ef:00:00")
+    scanner = NetworkEventDetector(backend=backend)
+
+    async def scenario():
+        await backend.drained()
+        assert events.get() == [
+            ("interface_added", "foo", "foo_key", None, None),
+            ("address_added", "foo", "foo_key", 18, "de:ad:be:ef:00:00"),
+        ]
+
+        # Redundant changes are ignored
+        backend.post(NetworkEventType.INTERFACE_ADDED, "foo")
+        backend.post(NetworkEventType.ADDRESS_ADDED, "foo", 18, "de:ad:be:ef:00:00")
+        backend.post(NetworkEventType.ADDRESS_REMOVED, "foo", 2, "10.0.0.1")
+        backend.post(NetworkEventType.INTERFACE_REMOVED, "bar")
+        await backend.drained()
+        assert events.get() == []
+
+        # Addresses of unknown interfaces imply the addition of the interface
+        backend.post(NetworkEventType.ADDRESS_ADDED, "bar", 2, "10.0.0.1")
+        await backend.drained()
+        assert events.get() == [
+            ("interface_added", "bar", "bar_key", None, None),
+            ("address_added", "bar", "bar_key", 2, "10.0.0.1"),
+        ]
+
+        backend.post(NetworkEventType.ADDRESS_REMOVED, "foo", 18, "de:ad:be:ef:00:00")
+        backend.post(NetworkEventType.INTERFACE_REMOVED, "bar")
+        await backend.drained()
+        assert events.get() == [
+            ("address_removed", "foo", "foo_key", 18, "de:ad:be:ef:00:00"),
+            ("address_removed", "bar", "bar_key", 2, "10.0.0.1"),
+            ("interface_removed", "bar", "bar_key", None, None),
+        ]
+
+    await _run_scenario(
+        scanner.events(), scenario, lambda event: events.add(_as_tuple(event))
+    )
+
+
+@mark.anyio
+async def test_interface_vanishing_during_scan(events):
+    # Not using the shared backend because we patch one of its methods
+    backend = MockBackend()
+    get_addresses = backend.get_addresses
+    vanished = set()
+
+    async def get_addresses_or_none(interface):
+        return None if interface in vanished else await get_addresses(interface)
+
+    backend.get_addresses = get_addresses_or_none
+    scanner = NetworkEventDetector(backend=backend)
+
+    async def scenario():
+        backend.add("foo", 2, "10.0.0.1")
+        vanished.add("bar")
+        backend.add("bar", 2, "10.0.0.2")
+        await backend.drained()
+        assert events.get() == [
+            ("interface_added", "foo", "foo_key", None, None),
+            ("address_added", "foo", "foo_key", 2, "10.0.0.1"),
+        ]
+
+        vanished.add("foo")
+        backend.add("foo", 2, "10.0.0.3")
+        await backend.drained()
+        assert events.get() == [
+            ("address_removed", "foo", "foo_key", 2, "10.0.0.1"),
+            ("interface_removed", "foo", "foo_key", None, None),
+        ]
+
+    await _run_scenario(
+        scanner.events(), scenario, lambda event: events.add(_as_tuple(event))
+    )
 
 
 @mark.anyio
 async def test_event_generator_suspension(backend, events):
     scanner = NetworkEventDetector(backend=backend)
 
-    async def scenario(end):
+    async def scenario():
         with scanner.suspended():
-            await sleep(0.003)
+            # Wait until the detector notices the suspension and parks itself
+            await wait_all_tasks_blocked()
 
             backend.add("foo")
-            await sleep(0.003)
+            await wait_all_tasks_blocked()
             assert events.get() == []
 
             backend.add("bar")
             backend.add("bar")
             backend.add("bar")
-            await sleep(0.003)
+            await wait_all_tasks_blocked()
             assert events.get() == []
 
             backend.remove("bar")
             backend.add("baz")
-            await sleep(0.003)
+            await wait_all_tasks_blocked()
             assert events.get() == []
 
-        await sleep(0.003)
-        assert sorted(events.get()) == [
+        await backend.drained()
+        assert events.get_set() == {
             ("interface_added", "baz", "baz_key"),
             ("interface_added", "foo", "foo_key"),
-        ]
+        }
 
         backend.remove("foo")
         backend.remove("baz")
-        await sleep(0.003)
-        assert sorted(events.get()) == [
+        await backend.drained()
+        assert events.get_set() == {
             ("interface_removed", "baz", "baz_key"),
             ("interface_removed", "foo", "foo_key"),
-        ]
-
-        end()
-
-    async with create_task_group() as tg:
-        with CancelScope() as scope:
-            tg.start_soon(scenario, scope.cancel)
-            async for event in scanner.events():
-                events.add((event.type.value, event.interface, event.key))
-
-
+        }
+
+    await _run_scenario(
+        scanner.events(),
+        scenario,
+        lambda event: events.add(_as_tuple(event)[:3]),
+    )
+
+
+@mark.parametrize(
+    "generator, expected",
+    [
+        ("added_interfaces", [["foo"], ["bar"], ["baz"], set()]),
+        ("removed_interfaces", [[], [], ["bar"], {"baz", "foo"}]),
+    ],
+)
 @mark.anyio
-async def test_added_interface_generator(backend, events):
+async def test_interface_generator(backend, events, generator, expected):
     scanner = NetworkEventDetector(backend=backend)
 
-    async def scenario(end):
+    async def scenario():
         backend.add("foo")
-        await sleep(0.003)
-        assert events.get() == ["foo"]
+        await backend.drained()
+        assert events.get() == expected[0]
 
         backend.add("bar")
         backend.add("bar")
         backend.add("bar")
-        await sleep(0.003)
-        assert events.get() == ["bar"]
+        await backend.drained()
+        assert events.get() == expected[1]
 
         backend.remove("bar")
         backend.add("baz")
-        await sleep(0.003)
-        assert events.get() == ["baz"]
+        await backend.drained()
+        assert events.get() == expected[2]
 
         backend.remove("foo")
         backend.remove("baz")
-        await sleep(0.003)
-        assert events.get() == []
+        await backend.drained()
+        assert events.get_set() == expected[3]
+
+    await _run_scenario(getattr(scanner, generator)(), scenario, events.add)
+
+
+@mark.parametrize(
+    "generator",
+    [
+        "added_addresses",
+        "added_interfaces",
+        "changed_addresses",
+        "events",
+        "events_batched",
+        "removed_addresses",
+        "removed_interfaces",
+    ],
+)
+@mark.anyio
+async def test_closing_generator_releases_backend(generator):
+    backend = LifecycleTrackingMockBackend()
+    backend.add("foo", 2, "10.0.0.1")
+    scanner = NetworkEventDetector(backend=backend)
+    items = getattr(scanner, generator)()
 
-        end()
+    async def remove_interface():
+        await backend.drained()
+        backend.remove("foo")
 
     async with create_task_group() as tg:
-        with CancelScope() as scope:
-            tg.start_soon(scenario, scope.cancel)
-            async for interface in scanner.added_interfaces():
-                events.add(interface)
+        tg.start_soon(remove_interface)
+        assert await items.__anext__()
+        tg.cancel_scope.cancel()
 
+    assert backend.in_use
+    await items.aclose()
+    assert not backend.in_use
 
-@mark.anyio
-async def test_removed_interface_generator(backend, events):
-    scanner = NetworkEventDetector(backend=backend)
 
-    async def scenario(end):
-        backend.add("foo")
-        await sleep(0.003)
-        assert events.get() == []
+def test_address_comparison_ignores_sequence_types():
+    # Entries updated incrementally store tuples while backends may return
+    # lists; this should not be reported as a change
+    entry = NetworkEventDetectorEntry(
+        interface="foo",
+        key="foo_key",
+        addresses={2: ("10.0.0.1",), 10: ("fd00::1", "fe80::1")},
+    )
+    new = {2: ["10.0.0.1"], 10: ["fd00::1", "fe80::1"]}
+    assert NetworkEventDetector._compare_addresses(entry, new) == ([], [])
 
-        backend.add("bar")
-        backend.add("bar")
-        backend.add("bar")
-        await sleep(0.003)
-        assert events.get() == []
+    new = {2: ["10.0.0.2"], 10: ["fd00::1"]}
+    assert NetworkEventDetector._compare_addresses(entry, new) == (
+        [("foo", "foo_key", 2, "10.0.0.2")],
+        [("foo", "foo_key", 2, "10.0.0.1"), ("foo", "foo_key", 10, "fe80::1")],
+    )
 
-        backend.remove("bar")
-        backend.add("baz")
-        await sleep(0.003)
-        assert events.get() == ["bar"]
 
-        backend.remove("foo")
-        backend.remove("baz")
-        await sleep(0.003)
-        assert sorted(events.get()) == ["baz", "foo"]
-
-        end()
-
-    async with create_task_group() as tg:
-        with CancelScope() as scope:
-            tg.start_soon(scenario, scope.cancel)
-            async for interface in scanner.removed_interfaces():
-                events.add(interface)
+@mark.anyio
+async def test_removed_interfaces_are_reported_in_discovery_order(backend, events):
+    scanner = NetworkEventDetector(backend=backend)
+    names = ["eth3", "eth1", "eth4", "eth0", "eth2"]
+
+    async def scenario():
+        for name in names:
+            backend.add(name)
+            await backend.drained()
+        assert events.get() == names
+
+        for name in names:
+            backend.remove(name)
+        await backend.drained()
+        assert events.get() == names
+
+    await _run_scenario(
+        scanner.events(), scenario, lambda event: events.add(event.interface)
+    )